@@ -2,6 +2,7 @@ import os
 import logging
 from logging.handlers import RotatingFileHandler
 from . import db
+from . import backup
 from flask import Flask, redirect, url_for, session, g, current_app, request
 from . import auth
 from . import jokes
@@ -72,6 +73,9 @@ def create_app(test_config=None):
     
     db.init_app(app)
     logging.info("Database initialized.")
+
+    backup.init_app(app)
+    logging.info("Backup commands registered.")
     
     app.register_blueprint(auth.bp)
     app.register_blueprint(jokes.bp)
@@ -0,0 +1,416 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process scheduler lock
+    fcntl = None
+
+BACKUP_PREFIX = 'flaskr-'
+BACKUP_SUFFIXES = ('.sqlite', '.sqlite.gz')
+SAFETY_PREFIX = 'pre-restore-'
+REQUIRED_TABLES = ('user', 'joke')
+SCHEDULER_LOCK = '.scheduler.lock'
+
+_scheduler_lock = threading.Lock()
+
+def _backup_config():
+    """Read backup settings from the app config, falling back to defaults."""
+    config = current_app.config
+    return {
+        'backup_dir': config.get('BACKUP_DIR') or os.path.join(current_app.instance_path, 'backups'),
+        'pages': config.get('BACKUP_PAGES', 64),
+        'pause': config.get('BACKUP_PAUSE', 0.005),
+        'retention': config.get('BACKUP_RETENTION', 7),
+        'compress': config.get('BACKUP_COMPRESS', True),
+        'probe_interval': config.get('BACKUP_PROBE_INTERVAL', 0.1),
+    }
+
+@contextmanager
+def _open_snapshot(path):
+    """Yield a plain SQLite path for a backup, decompressing gzipped backups to a temp file."""
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f'Backup not found: {path}')
+    if not path.endswith('.gz'):
+        yield path
+        return
+    fd, tmp_path = tempfile.mkstemp(suffix='.sqlite')
+    try:
+        try:
+            with os.fdopen(fd, 'wb') as f_out, gzip.open(path, 'rb') as f_in:
+                shutil.copyfileobj(f_in, f_out)
+        except (OSError, EOFError, zlib.error) as e:
+            raise sqlite3.DatabaseError(f'Could not decompress {path}: {e}') from e
+        yield tmp_path
+    finally:
+        os.remove(tmp_path)
+
+def _check_snapshot(snapshot_path, label):
+    """Check that a plain SQLite file passes an integrity check and has the app's tables."""
+    conn = sqlite3.connect(snapshot_path)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+    if result != 'ok':
+        logging.error("Integrity check failed for backup %s: %s", label, result)
+        raise sqlite3.DatabaseError(f'Integrity check failed for {label}: {result}')
+    missing = [table for table in REQUIRED_TABLES if table not in tables]
+    if missing:
+        logging.error("Backup %s is missing tables: %s", label, ', '.join(missing))
+        raise sqlite3.DatabaseError(f'Backup {label} is missing tables: {", ".join(missing)}')
+    logging.debug("Integrity check passed for backup %s.", label)
+
+def verify_backup(path):
+    """Check a backup file. Raises sqlite3.DatabaseError if it is corrupt or not an app database."""
+    with _open_snapshot(path) as snapshot_path:
+        _check_snapshot(snapshot_path, path)
+
+def list_backups(backup_dir):
+    """Return backup files in backup_dir, oldest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [
+        name for name in os.listdir(backup_dir)
+        if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIXES)
+    ]
+    return [os.path.join(backup_dir, name) for name in sorted(names)]
+
+def prune_backups(backup_dir, retention):
+    """Delete the oldest backups so that at most `retention` remain."""
+    backups = list_backups(backup_dir)
+    removed = backups[:-retention] if retention > 0 else []
+    for path in removed:
+        os.remove(path)
+        logging.info("Removed old backup %s.", path)
+    return removed
+
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+@contextmanager
+def _writer_stall_probe(database, interval=0.1):
+    """Measure how long a synthetic writer waits for the write lock while the block runs.
+
+    A background connection takes the write lock with BEGIN IMMEDIATE every `interval`
+    seconds and rolls back straight away, so no data is changed. The wait includes
+    time spent behind the app's own writers, not just the backup. Yields a dict whose
+    'max_writer_stall' holds the longest wait in seconds once the block exits, or
+    None if `interval` is falsy and the probe is disabled.
+    """
+    result = {'max_writer_stall': 0.0 if interval else None}
+    if not interval:
+        yield result
+        return
+    stop = threading.Event()
+
+    def probe():
+        conn = sqlite3.connect(database, timeout=30, isolation_level=None)
+        try:
+            while True:
+                started = time.perf_counter()
+                conn.execute('BEGIN IMMEDIATE')
+                stall = time.perf_counter() - started
+                conn.execute('ROLLBACK')
+                result['max_writer_stall'] = max(result['max_writer_stall'], stall)
+                if stop.wait(interval):
+                    break
+        except sqlite3.Error as e:
+            logging.warning("Writer stall probe failed: %s", str(e))
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=probe, name='flaskr-backup-probe', daemon=True)
+    thread.start()
+    try:
+        yield result
+    finally:
+        stop.set()
+        thread.join()
+
+def _describe_stall(stall):
+    if stall is None:
+        return 'writer stall probe off'
+    return f'max writer stall {stall * 1000:.1f}ms'
+
+def backup_database(database, backup_dir, pages=64, pause=0.005, compress=True, retention=None,
+                    prefix=BACKUP_PREFIX, verify=True, probe_interval=0.1):
+    """Copy `database` into a new snapshot in `backup_dir` using the online backup API.
+
+    The source connection holds a single read transaction on the WAL-mode database
+    for the whole copy, so the snapshot is consistent, the copy never restarts and
+    writers are not blocked. Pages are copied `pages` at a time with a `pause` between
+    steps to spread out the I/O. The snapshot is written under a `.partial` name, integrity
+    checked (unless `verify` is false) and optionally compressed, and only then moved to
+    its final name.
+
+    Returns a dict with the snapshot path, the copy duration, the total duration
+    (including verification, compression and pruning) and the longest time a
+    probe writer had to wait for the write lock during the copy (None when
+    `probe_interval` is 0).
+    """
+    if not os.path.isfile(database):
+        raise FileNotFoundError(f'Database not found: {database}')
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    path = os.path.join(backup_dir, f'{prefix}{timestamp}.sqlite')
+    final_path = path + '.gz' if compress else path
+    partial_path = path + '.partial'
+    gz_partial_path = path + '.gz.partial'
+    stats = {'steps': 0, 'pages': 0}
+
+    src = dst = None
+    started = time.perf_counter()
+
+    def progress(status, remaining, total):
+        stats['steps'] += 1
+        stats['pages'] = total
+        if remaining and pause:
+            time.sleep(pause)
+
+    try:
+        src = sqlite3.connect(database, isolation_level=None)
+        if src.execute('PRAGMA journal_mode=WAL').fetchone()[0] != 'wal':
+            raise sqlite3.OperationalError('Could not switch the database to WAL mode')
+        src.execute('BEGIN')
+        src.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        dst = sqlite3.connect(partial_path)
+        # The snapshot is verified before it is kept, so skip fsyncs that compete with app writes.
+        dst.execute('PRAGMA synchronous=OFF')
+        with _writer_stall_probe(database, probe_interval) as probe:
+            src.backup(dst, pages=pages, progress=progress)
+        dst.execute('PRAGMA journal_mode=DELETE')
+        dst.close()
+        dst = None
+        copy_duration = time.perf_counter() - started
+
+        if verify:
+            _check_snapshot(partial_path, final_path)
+        if compress:
+            with open(partial_path, 'rb') as f_in, gzip.open(gz_partial_path, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.replace(gz_partial_path, final_path)
+            os.remove(partial_path)
+        else:
+            os.replace(partial_path, final_path)
+    except Exception as e:
+        logging.error("Database backup failed: %s", str(e))
+        raise
+    finally:
+        if src is not None:
+            src.close()
+        if dst is not None:
+            dst.close()
+        _remove_if_exists(partial_path)
+        _remove_if_exists(gz_partial_path)
+
+    if retention:
+        prune_backups(backup_dir, retention)
+    duration = time.perf_counter() - started
+
+    logging.info(
+        "Backup %s written in %.3fs, copy %.3fs (%d pages, %d steps, %s).",
+        final_path, duration, copy_duration, stats['pages'], stats['steps'],
+        _describe_stall(probe['max_writer_stall'])
+    )
+    return {
+        'path': final_path,
+        'duration': duration,
+        'copy_duration': copy_duration,
+        'max_writer_stall': probe['max_writer_stall'],
+        'pages': stats['pages'],
+        'steps': stats['steps'],
+    }
+
+def _save_raw_copy(database, backup_dir):
+    """Copy the database file (and its WAL, if any) byte for byte into `backup_dir`."""
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    path = os.path.join(backup_dir, f'{SAFETY_PREFIX}{timestamp}.raw')
+    shutil.copyfile(database, path)
+    if os.path.isfile(database + '-wal'):
+        shutil.copyfile(database + '-wal', path + '-wal')
+    return path
+
+def _replace_database_file(snapshot_path, database):
+    """Swap the snapshot in as the database file, for when `database` can't be opened."""
+    tmp_path = database + '.restore.partial'
+    try:
+        shutil.copyfile(snapshot_path, tmp_path)
+        os.replace(tmp_path, database)
+    finally:
+        _remove_if_exists(tmp_path)
+    _remove_if_exists(database + '-wal')
+    _remove_if_exists(database + '-shm')
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+    finally:
+        conn.close()
+
+def restore_database(path, database, backup_dir=None):
+    """Overwrite `database` with the contents of the backup at `path`.
+
+    The backup is checked first. If `backup_dir` is given, the current database is
+    saved there under a `pre-restore-` name before it is overwritten, falling back to
+    a raw file copy when it can't be read as a database. A database that SQLite can't
+    open is replaced file-wise instead of through the backup API, so a corrupt
+    database can still be restored. Returns the path of the safety copy, or None.
+    """
+    safety_path = None
+    with _open_snapshot(path) as snapshot_path:
+        _check_snapshot(snapshot_path, path)
+        if backup_dir and os.path.isfile(database):
+            try:
+                safety_path = backup_database(
+                    database, backup_dir, prefix=SAFETY_PREFIX, verify=False, probe_interval=0
+                )['path']
+            except sqlite3.DatabaseError as e:
+                logging.warning("Could not back up current database (%s); saving a raw copy.", str(e))
+                safety_path = _save_raw_copy(database, backup_dir)
+            logging.info("Saved current database to %s before restoring.", safety_path)
+        src = sqlite3.connect(snapshot_path)
+        dst = sqlite3.connect(database)
+        try:
+            src.backup(dst)
+        except sqlite3.DatabaseError as e:
+            logging.warning("Could not restore into %s (%s); replacing the file.", database, str(e))
+            src.close()
+            dst.close()
+            _replace_database_file(snapshot_path, database)
+        finally:
+            src.close()
+            dst.close()
+    logging.info("Database %s restored from backup %s.", database, path)
+    return safety_path
+
+def run_backup(compress=None):
+    """Back up the app database using the app's backup settings."""
+    config = _backup_config()
+    if compress is None:
+        compress = config['compress']
+    return backup_database(
+        current_app.config['DATABASE'],
+        config['backup_dir'],
+        pages=config['pages'],
+        pause=config['pause'],
+        compress=compress,
+        retention=config['retention'],
+        probe_interval=config['probe_interval'],
+    )
+
+def start_backup_scheduler(app, interval):
+    """Start a daemon thread that backs up the database every `interval` seconds.
+
+    Returns the threading.Event used to stop the thread.
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            with app.app_context():
+                try:
+                    run_backup()
+                except Exception as e:
+                    logging.error("Scheduled backup failed: %s", str(e))
+
+    thread = threading.Thread(target=loop, name='flaskr-backup', daemon=True)
+    thread.start()
+    logging.info("Backup scheduler started with an interval of %ss.", interval)
+    return stop
+
+def _acquire_scheduler_lock(backup_dir):
+    """Take an exclusive lock file so only one process runs the scheduler.
+
+    Returns the open lock file (keep it open to hold the lock), or None if another
+    process already holds it.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    lock_file = open(os.path.join(backup_dir, SCHEDULER_LOCK), 'w')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+def _ensure_backup_scheduler():
+    """Start the scheduler on the first request.
+
+    CLI commands and the reloader parent never serve requests, so they never start it,
+    and the lock file keeps other worker processes from starting a second one.
+    """
+    app = current_app._get_current_object()
+    if 'backup_scheduler' in app.extensions:
+        return
+    with _scheduler_lock:
+        if 'backup_scheduler' in app.extensions:
+            return
+        app.extensions['backup_scheduler'] = None
+        lock_file = _acquire_scheduler_lock(_backup_config()['backup_dir'])
+        if lock_file is None:
+            logging.info("Backup scheduler already running in another process.")
+            return
+        app.extensions['backup_scheduler_lock'] = lock_file
+        app.extensions['backup_scheduler'] = start_backup_scheduler(app, app.config['BACKUP_INTERVAL'])
+
+@click.command('backup')
+@click.option('--no-compress', is_flag=True, help='Keep the snapshot as a plain SQLite file.')
+@with_appcontext
+def backup_command(no_compress):
+    """CLI command to take an online backup of the database."""
+    try:
+        result = run_backup(compress=False if no_compress else None)
+    except Exception as e:
+        click.echo(f'Error backing up database: {str(e)}')
+        logging.error("Backup command failed: %s", str(e))
+        return
+    click.echo(
+        f"Backup written to {result['path']} in {result['duration']:.3f}s "
+        f"(copy {result['copy_duration']:.3f}s, {_describe_stall(result['max_writer_stall'])})."
+    )
+
+@click.command('restore')
+@click.argument('path', required=False)
+@click.confirmation_option(prompt='This will overwrite the current database. Continue?')
+@with_appcontext
+def restore_command(path):
+    """CLI command to restore the database from a backup (the latest one by default)."""
+    if path is None:
+        backups = list_backups(_backup_config()['backup_dir'])
+        if not backups:
+            click.echo('No backups found.')
+            return
+        path = backups[-1]
+    try:
+        safety_path = restore_database(path, current_app.config['DATABASE'], _backup_config()['backup_dir'])
+        if safety_path:
+            click.echo(f'Saved the previous database to {safety_path}.')
+        click.echo(f'Restored the database from {path}.')
+    except Exception as e:
+        click.echo(f'Error restoring database: {str(e)}')
+        logging.error("Restore command failed: %s", str(e))
+
+def init_app(app):
+    """Register backup CLI commands and, if BACKUP_INTERVAL is set, the scheduler hook."""
+    app.cli.add_command(backup_command)
+    app.cli.add_command(restore_command)
+    if app.config.get('BACKUP_INTERVAL'):
+        app.before_request(_ensure_backup_scheduler)
@@ -39,6 +39,7 @@ def init_db():
         db = get_db()
         with current_app.open_resource('schema.sql') as f:
             db.executescript(f.read().decode('utf8'))
+        db.execute('PRAGMA journal_mode=WAL')  # Persistent; readers (and backups) don't block writers
         logging.info("Database schema initialized successfully.")
     except FileNotFoundError:
         logging.error("Schema file not found during initialization.")
@@ -0,0 +1,206 @@
+import gzip
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import flaskr
+from flaskr import backup, create_app
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', 'flaskr', 'schema.sql')
+
+@pytest.fixture
+def database(tmp_path):
+    """A WAL-mode app database with one user and a few MB of jokes."""
+    path = str(tmp_path / 'flaskr.sqlite')
+    conn = sqlite3.connect(path)
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute("INSERT INTO user (email, nickname, password) VALUES ('a@b.c', 'alice', 'x')")
+    conn.executemany(
+        'INSERT INTO joke (user_id, title, body) VALUES (1, ?, ?)',
+        ((f'joke {i}', 'ha ' * 200) for i in range(5000))
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+@pytest.fixture
+def make_app(database, tmp_path, monkeypatch):
+    """Build the app against the test database without writing to flaskr/logs/app.log."""
+    monkeypatch.setattr(flaskr, 'setup_logging', lambda app=None: None)
+
+    def make(**config):
+        return create_app({
+            'TESTING': True,
+            'DATABASE': database,
+            'BACKUP_DIR': str(tmp_path / 'backups'),
+            **config,
+        })
+    return make
+
+def count_jokes(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT count(*) FROM joke').fetchone()[0]
+    finally:
+        conn.close()
+
+def test_backup_does_not_block_writer(database, tmp_path):
+    stop = threading.Event()
+    waits = []
+
+    def writer():
+        conn = sqlite3.connect(database, timeout=5, isolation_level=None)
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            conn.execute('BEGIN IMMEDIATE')
+            waits.append(time.perf_counter() - started)
+            conn.execute('INSERT INTO joke (user_id, title, body) VALUES (1, ?, ?)', (f'new {i}', 'ha'))
+            conn.execute('COMMIT')
+            i += 1
+            time.sleep(0.002)
+        conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        time.sleep(0.05)
+        result = backup.backup_database(database, str(tmp_path / 'backups'), pages=16, pause=0.001)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert result['steps'] > 1
+    assert len(waits) > 10
+    assert max(waits) < 0.05
+    assert result['max_writer_stall'] < 0.05
+    backup.verify_backup(result['path'])
+    with backup._open_snapshot(result['path']) as snapshot:
+        assert 5000 <= count_jokes(snapshot) <= count_jokes(database)
+
+def test_backup_restore_round_trip(database, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    result = backup.backup_database(database, backup_dir)
+    assert result['path'].endswith('.sqlite.gz')
+
+    conn = sqlite3.connect(database)
+    conn.execute('DELETE FROM joke')
+    conn.commit()
+    conn.close()
+
+    safety_path = backup.restore_database(result['path'], database, backup_dir)
+    assert count_jokes(database) == 5000
+    assert os.path.basename(safety_path).startswith(backup.SAFETY_PREFIX)
+    with backup._open_snapshot(safety_path) as snapshot:
+        assert count_jokes(snapshot) == 0
+    assert backup.list_backups(backup_dir) == [result['path']]
+
+def test_restore_over_corrupt_database(database, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    result = backup.backup_database(database, backup_dir)
+    with open(database, 'wb') as f:
+        f.write(b'not a database' * 1000)
+
+    safety_path = backup.restore_database(result['path'], database, backup_dir)
+    assert count_jokes(database) == 5000
+    assert safety_path.endswith('.raw')
+    with open(safety_path, 'rb') as f:
+        assert f.read().startswith(b'not a database')
+
+def test_retention_ignores_partial_files(database, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    os.makedirs(backup_dir)
+    partial = os.path.join(backup_dir, 'flaskr-00000000T000000000000.sqlite.partial')
+    open(partial, 'w').close()
+    paths = [backup.backup_database(database, backup_dir, retention=2)['path'] for _ in range(3)]
+    assert backup.list_backups(backup_dir) == paths[1:]
+    assert os.path.exists(partial)
+
+def test_backup_missing_database(tmp_path):
+    missing = str(tmp_path / 'missing.sqlite')
+    with pytest.raises(FileNotFoundError):
+        backup.backup_database(missing, str(tmp_path / 'backups'))
+    assert not os.path.exists(missing)
+
+def test_restore_rejects_empty_backup(database, tmp_path):
+    empty = str(tmp_path / 'flaskr-empty.sqlite')
+    open(empty, 'w').close()
+    with pytest.raises(sqlite3.DatabaseError):
+        backup.restore_database(empty, database, str(tmp_path / 'backups'))
+    assert count_jokes(database) == 5000
+
+@pytest.mark.parametrize('damage', ['truncated', 'corrupt', 'truncated database'])
+def test_verify_backup_rejects_damaged_gzip(database, tmp_path, damage):
+    path = backup.backup_database(database, str(tmp_path / 'backups'))['path']
+    if damage == 'truncated database':
+        with backup._open_snapshot(path) as snapshot, open(snapshot, 'rb') as f:
+            data = f.read()
+        with gzip.open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+    else:
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+        if damage == 'truncated':
+            data = data[:len(data) // 2]
+        else:
+            data[len(data) // 2:len(data) // 2 + 64] = bytes(64)
+        with open(path, 'wb') as f:
+            f.write(data)
+    with pytest.raises(sqlite3.DatabaseError):
+        backup.verify_backup(path)
+
+def test_backup_command_no_compress(make_app, tmp_path):
+    app = make_app()
+    result = app.test_cli_runner().invoke(args=['backup', '--no-compress'])
+    assert 'max writer stall' in result.output
+    assert backup.list_backups(str(tmp_path / 'backups'))[0].endswith('.sqlite')
+    assert 'BACKUP_COMPRESS' not in app.config
+
+def test_restore_command_uses_latest_backup(make_app, database, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    backup.backup_database(database, backup_dir)
+    conn = sqlite3.connect(database)
+    conn.execute("INSERT INTO joke (user_id, title, body) VALUES (1, 'latest', 'ha')")
+    conn.commit()
+    backup.backup_database(database, backup_dir)
+    conn.execute('DELETE FROM joke')
+    conn.commit()
+    conn.close()
+
+    runner = make_app().test_cli_runner()
+    result = runner.invoke(args=['restore'], input='n\n')
+    assert result.exit_code != 0
+    assert count_jokes(database) == 0
+
+    result = runner.invoke(args=['restore', '--yes'])
+    assert 'Restored the database' in result.output
+    assert count_jokes(database) == 5001
+
+def test_restore_command_without_backups(make_app):
+    result = make_app().test_cli_runner().invoke(args=['restore', '--yes'])
+    assert 'No backups found.' in result.output
+
+def test_scheduler_starts_once_on_first_request(make_app, tmp_path):
+    app = make_app(BACKUP_INTERVAL=60)
+    backup_dir = str(tmp_path / 'backups')
+    assert 'backup_scheduler' not in app.extensions
+
+    client = app.test_client()
+    client.get('/auth/login')
+    client.get('/auth/login')
+    stop = app.extensions['backup_scheduler']
+    try:
+        threads = [t for t in threading.enumerate() if t.name == 'flaskr-backup']
+        assert len(threads) == 1
+        assert os.path.exists(os.path.join(backup_dir, backup.SCHEDULER_LOCK))
+        if backup.fcntl is not None:
+            assert backup._acquire_scheduler_lock(backup_dir) is None
+    finally:
+        stop.set()
+        threads[0].join()
+        app.extensions['backup_scheduler_lock'].close()